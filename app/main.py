@@ -1,19 +1,31 @@
 from fastapi import FastAPI, Request, Form, UploadFile, File
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, Response
 from fastapi.staticfiles import StaticFiles
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.templating import Jinja2Templates
+from starlette.concurrency import run_in_threadpool
 from datetime import datetime
-from defusedxml import ElementTree as defused_et
-import xml.dom.minidom
-import xml.etree.ElementTree as ET
+from cachetools import LRUCache
+from lxml import etree as LET
+from xml.parsers import expat
+from xml.parsers.expat import ExpatError
+from types import SimpleNamespace
+import asyncio
+import hashlib
+import time
+import threading
 import xmltodict
-import re
+import orjson
+import json
 
 # ---------------------------------------------------
 #  APP CONFIG
 # ---------------------------------------------------
 app = FastAPI(title="XML Beauty")
 
+# gzip responses over 1 KB (pretty-printed XML compresses well); adds Vary: Accept-Encoding
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
+
 # mount static files (CSS, JS)
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
 
@@ -29,10 +41,17 @@ templates = Jinja2Templates(directory="app/templates")
 def home(request: Request):
     return templates.TemplateResponse("xml_tool.html", {"request": request, "now": datetime.utcnow()})
 
+# the /api/time JSON body is rebuilt at most once per second: (monotonic time built, body), swapped as one tuple
+_api_time_cache = (float("-inf"), b"")
+
 # Small demo route (keep or remove as you like)
 @app.get("/api/time")
 def api_time():
-    return JSONResponse({"utc": datetime.utcnow().isoformat()})
+    global _api_time_cache
+    now = time.monotonic()
+    if now - _api_time_cache[0] >= 1.0:
+        _api_time_cache = (now, orjson.dumps({"utc": datetime.utcnow().isoformat()}))
+    return Response(_api_time_cache[1], media_type="application/json")
 
 @app.get("/privacy", response_class=HTMLResponse)
 def privacy(request: Request):
@@ -42,90 +61,253 @@ def privacy(request: Request):
 #  XML FORMATTER ENDPOINTS
 # ---------------------------------------------------
 MAX_XML_BYTES = 1_000_000  # 1 MB limit
+UPLOAD_CHUNK_BYTES = 64 * 1024  # uploads are read in chunks of this size
+# deepest element nesting accepted by every endpoint. This is libxml2's own limit while
+# huge_tree stays off (lxml enforces it), and _parse_xml_dict applies the same cap for xmltodict.
+MAX_XML_DEPTH = 256
 
+# legal indent widths for /xml/format; anything else falls back to 4 spaces
+_INDENTS = {2: "  ", 3: "   ", 4: "    "}
 
-def _read_uploaded_file(upload: UploadFile):
-    """Helper to read uploaded file content as text (utf-8 fallback to latin1)."""
-    contents = None
-    if upload and getattr(upload, "filename", None):
-        data = None
-        # NOTE: caller must await .read() ; this helper expects bytes passed in instead.
-        return None
-    return None
+# what the parsers raise for bad input: lxml, xmltodict/expat;
+# ValueError covers rejected entity declarations and excessive depth,
+# LookupError an unknown encoding declared in an upload (expat)
+_PARSE_ERRORS = (LET.XMLSyntaxError, ExpatError, ValueError, LookupError)
 
+# results are pure functions of (operation, input bytes, options): keep recent JSON bodies,
+# bounded by total size rather than entry count since a body can approach MAX_XML_BYTES
+RESULT_CACHE_BYTES = 32 * 1024 * 1024
+_result_cache = LRUCache(maxsize=RESULT_CACHE_BYTES, getsizeof=len)
+_result_cache_lock = asyncio.Lock()
 
-def _extract_error_line(msg: str):
-    """Try to extract a line number from parser error text."""
-    if not msg:
-        return None
-    m = re.search(r'line\s+(\d+)', msg, re.IGNORECASE)
-    if m:
-        try:
-            return int(m.group(1))
-        except Exception:
-            return None
-    return None
 
+async def _read_capped(upload: UploadFile, limit: int):
+    """Read an upload in chunks, stopping as soon as it exceeds `limit` bytes.
+    Returns (bytes or None if too large, bytes read so far)."""
+    buf = bytearray()
+    while True:
+        chunk = await upload.read(UPLOAD_CHUNK_BYTES)
+        if not chunk:
+            break
+        buf.extend(chunk)
+        if len(buf) > limit:
+            return None, len(buf)
+    return bytes(buf), len(buf)
 
-@app.post("/xml/format")
-async def xml_format(
-    request: Request,
-    xml_text: str = Form(None),
-    xml_file: UploadFile = File(None),
-    indent_spaces: int = Form(4)
-):
+
+# lxml parsers must not be shared between threads, so each threadpool worker keeps its own
+# (one per forced encoding: None follows the document's declaration)
+_parser_tls = threading.local()
+
+
+def _get_parser(encoding=None):
+    """This thread's hardened lxml parser for `encoding`, created on first use."""
+    parsers = getattr(_parser_tls, "parsers", None)
+    if parsers is None:
+        parsers = _parser_tls.parsers = {}
+    parser = parsers.get(encoding)
+    if parser is None:
+        parser = LET.XMLParser(encoding=encoding, resolve_entities=False, no_network=True, huge_tree=False, remove_blank_text=True)
+        parsers[encoding] = parser
+    return parser
+
+
+def _parse_xml(data: bytes, encoding=None):
     """
-    Validate and pretty-print XML.
-    Returns JSON:
-      - success: { "pretty": "<formatted xml>" }
-      - error:   { "error": "message", "line": <line number optional> }
+    Parse XML once with entity expansion and network access disabled; returns the root element.
+    `encoding` overrides the document's declaration (None follows it).
+    Documents that declare entities are rejected, as with defusedxml and xmltodict's disable_entities:
+    the references would be left unexpanded and the serialized output would not be well-formed.
+    So are references left undefined behind an external DTD that is never loaded, like convert.
+    """
+    root = LET.fromstring(data, _get_parser(encoding))
+    docinfo = root.getroottree().docinfo
+    dtd = docinfo.internalDTD
+    if dtd is not None and next(dtd.iterentities(), None) is not None:
+        raise ValueError("entities are disabled")
+    # without an external DTD libxml2 already fails on undefined entities; with one it keeps them
+    if docinfo.system_url or docinfo.public_id:
+        ref = next(root.iter(LET.Entity), None)
+        if ref is not None:
+            raise ValueError(f"undefined entity {ref.text}")
+    return root
+
+
+def _check_depth(path, key, value):
+    """xmltodict postprocessor: `path` runs from the root to the current element."""
+    if len(path) > MAX_XML_DEPTH:
+        raise ValueError(f"Excessive depth in document: more than {MAX_XML_DEPTH} levels")
+    return key, value
+
+
+def _forbid_skipped_entity(name, is_parameter_entity):
+    raise ValueError(f"undefined entity &{name};")
+
+
+def _strict_parser_create(*args):
+    """expat.ParserCreate for xmltodict: a document with an external DTD (never loaded) makes
+    expat skip undefined entity references instead of failing, and xmltodict would drop them."""
+    parser = expat.ParserCreate(*args)
+    parser.SkippedEntityHandler = _forbid_skipped_entity
+    return parser
+
+
+_strict_expat = SimpleNamespace(ParserCreate=_strict_parser_create)
+
+
+def _parse_xml_dict(data: bytes, encoding=None):
+    """Validate and convert XML to a dict in one pass; xmltodict's expat parser rejects
+    malformed XML, undefined entities and, with disable_entities, any entity declarations.
+    Nesting is capped at MAX_XML_DEPTH like the lxml endpoints."""
+    return xmltodict.parse(data, encoding=encoding, disable_entities=True, postprocessor=_check_depth, expat=_strict_expat)
+
+
+def _error_line(e: Exception):
+    """Line number reported by the parser (.lineno on lxml and expat errors), else None."""
+    return getattr(e, "lineno", None)
+
+
+async def _load_xml(xml_text, xml_file):
+    """
+    Shared request preamble: pick the source, enforce the size limit and strip.
+    Returns (bytes, encoding, None) on success or (None, None, JSONResponse) describing the error.
+    encoding is "utf-8" for pasted text, which we encoded ourselves whatever its declaration
+    says, and None for uploads, whose bytes follow their own declaration.
     """
-    raw = ""
+    data = b""
+    encoding = None
     # pick source
     if xml_file and getattr(xml_file, "filename", None):
-        contents = await xml_file.read()
-        if len(contents) > MAX_XML_BYTES:
-            return JSONResponse({"error": f"File too large ({len(contents)} bytes). Max {MAX_XML_BYTES} bytes."}, status_code=400)
-        try:
-            raw = contents.decode("utf-8")
-        except Exception:
-            raw = contents.decode("latin-1", errors="ignore")
+        # Starlette records the spooled upload's size; reject oversized files without reading them back
+        size = getattr(xml_file, "size", None)
+        if size is not None and size > MAX_XML_BYTES:
+            return None, None, JSONResponse({"error": f"File too large ({size} bytes). Max {MAX_XML_BYTES} bytes."}, status_code=413)
+        # keep the upload as bytes: the parser honours the document's own encoding declaration
+        data, nread = await _read_capped(xml_file, MAX_XML_BYTES)
+        if data is None:
+            return None, None, JSONResponse({"error": f"File too large (at least {nread} bytes). Max {MAX_XML_BYTES} bytes."}, status_code=413)
     elif xml_text is not None:
-        raw = xml_text
-        if len(raw.encode("utf-8")) > MAX_XML_BYTES:
-            return JSONResponse({"error": f"Text too large ({len(raw.encode('utf-8'))} bytes). Max {MAX_XML_BYTES} bytes."}, status_code=400)
+        # encode once; the same bytes are size-checked and parsed
+        data = xml_text.encode("utf-8")
+        encoding = "utf-8"
+        if len(data) > MAX_XML_BYTES:
+            return None, None, JSONResponse({"error": f"Text too large ({len(data)} bytes). Max {MAX_XML_BYTES} bytes."}, status_code=400)
     else:
-        return JSONResponse({"error": "No XML provided. Paste XML or upload an .xml file."}, status_code=400)
+        return None, None, JSONResponse({"error": "No XML provided. Paste XML or upload an .xml file."}, status_code=400)
 
-    raw_stripped = raw.strip()
-    if not raw_stripped:
-        return JSONResponse({"error": "Empty XML content."}, status_code=400)
+    data = data.strip()
+    if not data:
+        return None, None, JSONResponse({"error": "Empty XML content."}, status_code=400)
+    return data, encoding, None
 
-    # Validate using defusedxml
+
+def _parse_or_error(data: bytes, encoding=None, parse=_parse_xml):
+    """Validate and parse in one pass. Returns (parsed, None) or (None, JSONResponse)."""
+    try:
+        return parse(data, encoding), None
+    except _PARSE_ERRORS as e:
+        # lxml's .msg omits the "(<string>, line N)" suffix its str() adds
+        msg = e.msg if isinstance(e, LET.XMLSyntaxError) else str(e)
+        return None, JSONResponse({"error": f"XML parse error: {msg}", "line": _error_line(e)}, status_code=400)
+
+
+def _format_xml(data: bytes, encoding, indent_str: str):
+    """Pretty-print XML bytes. Returns ({"pretty": ...}, None) or (None, JSONResponse)."""
+    root, err = _parse_or_error(data, encoding)
+    if err:
+        return None, err
+
+    # Beautify the parsed tree with chosen indent; serializing the whole tree keeps the
+    # DOCTYPE and any comments/PIs around the root element (no XML declaration is emitted)
     try:
-        defused_et.fromstring(raw_stripped.encode("utf-8"))
+        LET.indent(root, space=indent_str)
+        pretty = LET.tostring(root.getroottree(), pretty_print=True, encoding="unicode")
     except Exception as e:
+        # If pretty-print fails, return an error (should be rare because parsing succeeded above)
         msg = str(e)
-        line = _extract_error_line(msg)
-        return JSONResponse({"error": f"XML parse error: {msg}", "line": line}, status_code=400)
+        return None, JSONResponse({"error": f"Failed to pretty-print XML: {msg}"}, status_code=400)
+
+    return {"pretty": pretty}, None
 
-    # Beautify using minidom with chosen indent
+
+def _minify_xml(data: bytes, encoding):
+    """Minify XML bytes. Returns ({"pretty": ...}, None) or (None, JSONResponse)."""
+    root, err = _parse_or_error(data, encoding)
+    if err:
+        return None, err
+
+    # minify using tostring (compact); blank text between tags is dropped by the parser,
+    # and serializing the whole tree keeps the DOCTYPE and comments/PIs around the root
     try:
-        dom = xml.dom.minidom.parseString(raw_stripped.encode("utf-8"))
-        indent = int(indent_spaces) if int(indent_spaces) in (2, 3, 4) else int(4)
-        pretty = dom.toprettyxml(indent=" " * indent)
-        pretty = "\n".join([line for line in pretty.splitlines() if line.strip() != ""])
+        compact = LET.tostring(root.getroottree(), encoding="unicode")
     except Exception as e:
-        # If pretty-print fails, return a parse error (should be rare because we validated above)
-        msg = str(e)
-        return JSONResponse({"error": f"Failed to pretty-print XML: {msg}"}, status_code=400)
+        return None, JSONResponse({"error": f"XML minify error: {str(e)}"}, status_code=400)
+
+    return {"pretty": compact}, None
+
 
-    return JSONResponse({"pretty": pretty})
+def _convert_xml(data: bytes, encoding):
+    """Convert XML bytes to a dict. Returns (dict, None) or (None, JSONResponse)."""
+    return _parse_or_error(data, encoding, parse=_parse_xml_dict)
+
+
+def _render_json(compute):
+    """Run compute() -> (content, error) and serialize a successful result. Returns (body, error)."""
+    content, err = compute()
+    if err:
+        return None, err
+    # orjson encodes straight to UTF-8 bytes, several times faster than JSONResponse's json.dumps
+    try:
+        return orjson.dumps(content), None
+    except orjson.JSONEncodeError:
+        # orjson stops at 255 levels of nesting, which deep /xml/convert output can reach;
+        # fall back to the same encoding JSONResponse uses
+        return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8"), None
+
+
+async def _cached_response(key: tuple, data: bytes, compute):
+    """
+    Serve the JSON body cached for (key, blake2b(data)), or run compute() -> (content, error)
+    and cache the body of successful results. Errors are returned uncached.
+    """
+    key = key + (hashlib.blake2b(data, digest_size=16).digest(),)
+    async with _result_cache_lock:
+        body = _result_cache.get(key)
+    if body is not None:
+        return Response(body, media_type="application/json")
+
+    # parse/format/serialize is CPU-bound: run it in a worker thread so the event loop keeps
+    # serving other requests (lxml releases the GIL while parsing and serializing)
+    body, err = await run_in_threadpool(_render_json, compute)
+    if err:
+        return err
+    if len(body) <= RESULT_CACHE_BYTES:
+        async with _result_cache_lock:
+            _result_cache[key] = body
+    return Response(body, media_type="application/json")
+
+
+@app.post("/xml/format")
+async def xml_format(
+    xml_text: str = Form(None),
+    xml_file: UploadFile = File(None),
+    indent_spaces: int = Form(4)
+):
+    """
+    Validate and pretty-print XML.
+    Returns JSON:
+      - success: { "pretty": "<formatted xml>" }
+      - error:   { "error": "message", "line": <line number optional> }
+    """
+    data, encoding, err = await _load_xml(xml_text, xml_file)
+    if err:
+        return err
+    indent_str = _INDENTS.get(indent_spaces, _INDENTS[4])
+    return await _cached_response(("format", indent_str, encoding), data, lambda: _format_xml(data, encoding, indent_str))
 
 
 @app.post("/xml/minify")
 async def xml_minify(
-    request: Request,
     xml_text: str = Form(None),
     xml_file: UploadFile = File(None)
 ):
@@ -133,46 +315,14 @@ async def xml_minify(
     Return compact/minified XML (no extra whitespace).
     JSON: { "pretty": "<minified-xml>" } or error object.
     """
-    raw = ""
-    if xml_file and getattr(xml_file, "filename", None):
-        contents = await xml_file.read()
-        if len(contents) > MAX_XML_BYTES:
-            return JSONResponse({"error": f"File too large ({len(contents)} bytes). Max {MAX_XML_BYTES} bytes."}, status_code=400)
-        try:
-            raw = contents.decode("utf-8")
-        except Exception:
-            raw = contents.decode("latin-1", errors="ignore")
-    elif xml_text is not None:
-        raw = xml_text
-        if len(raw.encode("utf-8")) > MAX_XML_BYTES:
-            return JSONResponse({"error": f"Text too large ({len(raw.encode('utf-8'))} bytes). Max {MAX_XML_BYTES} bytes."}, status_code=400)
-    else:
-        return JSONResponse({"error": "No XML provided."}, status_code=400)
-
-    raw = raw.strip()
-    if not raw:
-        return JSONResponse({"error": "Empty XML content."}, status_code=400)
-
-    # validate
-    try:
-        defused_et.fromstring(raw.encode("utf-8"))
-    except Exception as e:
-        line = _extract_error_line(str(e))
-        return JSONResponse({"error": f"XML parse error: {str(e)}", "line": line}, status_code=400)
-
-    # minify using ElementTree tostring (compact)
-    try:
-        tree = ET.fromstring(raw)
-        compact = ET.tostring(tree, encoding="utf-8").decode("utf-8")
-    except Exception as e:
-        return JSONResponse({"error": f"XML minify error: {str(e)}"}, status_code=400)
-
-    return JSONResponse({"pretty": compact})
+    data, encoding, err = await _load_xml(xml_text, xml_file)
+    if err:
+        return err
+    return await _cached_response(("minify", encoding), data, lambda: _minify_xml(data, encoding))
 
 
 @app.post("/xml/convert")
 async def xml_convert(
-    request: Request,
     xml_text: str = Form(None),
     xml_file: UploadFile = File(None)
 ):
@@ -180,37 +330,8 @@ async def xml_convert(
     Convert XML to JSON (structure).
     Returns JSON representation or error.
     """
-    raw = ""
-    if xml_file and getattr(xml_file, "filename", None):
-        contents = await xml_file.read()
-        if len(contents) > MAX_XML_BYTES:
-            return JSONResponse({"error": f"File too large ({len(contents)} bytes). Max {MAX_XML_BYTES} bytes."}, status_code=400)
-        try:
-            raw = contents.decode("utf-8")
-        except Exception:
-            raw = contents.decode("latin-1", errors="ignore")
-    elif xml_text is not None:
-        raw = xml_text
-        if len(raw.encode("utf-8")) > MAX_XML_BYTES:
-            return JSONResponse({"error": f"Text too large ({len(raw.encode('utf-8'))} bytes). Max {MAX_XML_BYTES} bytes."}, status_code=400)
-    else:
-        return JSONResponse({"error": "No XML provided."}, status_code=400)
-
-    raw = raw.strip()
-    if not raw:
-        return JSONResponse({"error": "Empty XML content."}, status_code=400)
-
-    # validate then convert
-    try:
-        defused_et.fromstring(raw.encode("utf-8"))
-    except Exception as e:
-        line = _extract_error_line(str(e))
-        return JSONResponse({"error": f"XML parse error: {str(e)}", "line": line}, status_code=400)
-
-    try:
-        parsed = xmltodict.parse(raw)
-    except Exception as e:
-        return JSONResponse({"error": f"XML->JSON parse error: {str(e)}"}, status_code=400)
-
-    # xmltodict returns an OrderedDict — JSONResponse will serialize it
-    return JSONResponse(parsed)
+    data, encoding, err = await _load_xml(xml_text, xml_file)
+    if err:
+        return err
+    # xmltodict returns a plain dict — orjson serializes it
+    return await _cached_response(("convert", encoding), data, lambda: _convert_xml(data, encoding))
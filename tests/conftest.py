@@ -0,0 +1,7 @@
+import os
+import sys
+
+# the app mounts "app/static" and "app/templates" relative to the working directory
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(ROOT)
+sys.path.insert(0, ROOT)
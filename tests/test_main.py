@@ -0,0 +1,143 @@
+from fastapi.testclient import TestClient
+
+from app.main import app
+
+client = TestClient(app)
+
+
+def post(path, xml, **extra):
+    return client.post(path, data={"xml_text": xml, **extra})
+
+
+XML_ENDPOINTS = ("/xml/format", "/xml/minify", "/xml/convert")
+
+
+# ---------------------------------------------------
+#  FORMAT / MINIFY
+# ---------------------------------------------------
+
+PROLOG_XML = '<?xml version="1.0"?>\n<!-- top comment -->\n<!DOCTYPE a>\n<?pi x?>\n<a><b> t </b>\n   <c/></a>'
+
+
+def test_format_keeps_prolog():
+    r = post("/xml/format", PROLOG_XML, indent_spaces="2")
+    assert r.status_code == 200
+    assert r.json()["pretty"] == '<!-- top comment -->\n<!DOCTYPE a>\n<?pi x?>\n<a>\n  <b> t </b>\n  <c/>\n</a>\n'
+
+
+def test_minify_keeps_prolog_and_drops_blank_text():
+    r = post("/xml/minify", PROLOG_XML)
+    assert r.status_code == 200
+    assert r.json()["pretty"] == '<!-- top comment --><!DOCTYPE a>\n<?pi x?><a><b> t </b><c/></a>'
+
+
+# ---------------------------------------------------
+#  PARSER SAFETY
+# ---------------------------------------------------
+
+INTERNAL_ENTITY_XML = '<?xml version="1.0"?><!DOCTYPE l [<!ENTITY a "aaaa"><!ENTITY b "&a;&a;">]><l>&b;</l>'
+XXE_XML = '<?xml version="1.0"?><!DOCTYPE l [<!ENTITY e SYSTEM "file:///etc/hostname">]><l>&e;</l>'
+
+
+def test_internal_entities_rejected():
+    for path in XML_ENDPOINTS:
+        r = post(path, INTERNAL_ENTITY_XML)
+        assert r.status_code == 400, path
+        assert r.json()["error"] == "XML parse error: entities are disabled"
+
+
+def test_external_entities_rejected():
+    for path in XML_ENDPOINTS:
+        r = post(path, XXE_XML)
+        assert r.status_code == 400, path
+        assert r.json()["error"] == "XML parse error: entities are disabled"
+
+
+def test_undefined_entities_behind_external_dtd_rejected():
+    # the external DTD is never loaded, so the parsers would otherwise skip &foo; silently
+    for path in XML_ENDPOINTS:
+        r = post(path, '<!DOCTYPE a SYSTEM "x.dtd"><a>x &foo; y</a>')
+        assert r.status_code == 400, path
+        assert r.json()["error"] == "XML parse error: undefined entity &foo;"
+
+
+def test_external_dtd_without_entity_references_allowed():
+    for path in XML_ENDPOINTS:
+        assert post(path, '<!DOCTYPE a SYSTEM "x.dtd"><a>x &amp; &#65; y</a>').status_code == 200, path
+
+
+def test_dtd_without_entities_allowed():
+    for path in XML_ENDPOINTS:
+        assert post(path, "<!DOCTYPE l [<!ELEMENT l ANY>]><l/>").status_code == 200, path
+
+
+def nested(depth):
+    return "<a>" * depth + "</a>" * depth
+
+
+def test_max_depth_accepted():
+    for path in ("/xml/format", "/xml/minify"):
+        assert post(path, nested(256)).status_code == 200, path
+
+
+def test_convert_at_max_depth():
+    # deeper than orjson's nesting limit: the body falls back to json.dumps
+    r = post("/xml/convert", nested(256))
+    assert r.status_code == 200
+    body = r.json()
+    for _ in range(255):
+        body = body["a"]
+    assert body == {"a": None}
+
+
+def test_beyond_max_depth_rejected():
+    for path in XML_ENDPOINTS:
+        r = post(path, nested(257))
+        assert r.status_code == 400, path
+        assert r.json()["error"].startswith("XML parse error: Excessive depth in document")
+
+
+# ---------------------------------------------------
+#  ENCODINGS
+# ---------------------------------------------------
+
+LATIN1_DECL_XML = '<?xml version="1.0" encoding="ISO-8859-1"?><a>\u00e9</a>'
+
+
+def test_pasted_text_is_utf8_whatever_its_declaration():
+    assert post("/xml/format", LATIN1_DECL_XML).json() == {"pretty": "<a>\u00e9</a>\n"}
+    assert post("/xml/minify", LATIN1_DECL_XML).json() == {"pretty": "<a>\u00e9</a>"}
+    assert post("/xml/convert", LATIN1_DECL_XML).json() == {"a": "\u00e9"}
+
+
+def test_upload_follows_its_declaration():
+    files = {"xml_file": ("f.xml", LATIN1_DECL_XML.encode("latin-1"), "text/xml")}
+    assert client.post("/xml/minify", files=files).json() == {"pretty": "<a>\u00e9</a>"}
+    assert client.post("/xml/convert", files=files).json() == {"a": "\u00e9"}
+
+
+def test_unknown_declared_encoding_is_a_parse_error():
+    files = {"xml_file": ("f.xml", b'<?xml version="1.0" encoding="bogus-enc"?><a/>', "text/xml")}
+    for path in XML_ENDPOINTS:
+        r = client.post(path, files=files)
+        assert r.status_code == 400, path
+        assert r.json()["error"].startswith("XML parse error:")
+
+
+# ---------------------------------------------------
+#  RESULT CACHE
+# ---------------------------------------------------
+
+def test_cache_keeps_indent_encoding_and_operation_apart():
+    xml = '<?xml version="1.0" encoding="ISO-8859-1"?><cache><b>\u00e9</b></cache>'
+    raw = xml.encode("utf-8")
+    upload = {"xml_file": ("f.xml", raw, "text/xml")}
+    # same bytes twice over, so the second of each pair would hit a wrongly shared entry
+    for _ in range(2):
+        assert post("/xml/format", xml, indent_spaces="2").json() == {"pretty": "<cache>\n  <b>\u00e9</b>\n</cache>\n"}
+        assert post("/xml/format", xml, indent_spaces="4").json() == {"pretty": "<cache>\n    <b>\u00e9</b>\n</cache>\n"}
+        # pasted text is UTF-8; the uploaded copy of those bytes follows its latin-1 declaration
+        assert post("/xml/minify", xml).json() == {"pretty": "<cache><b>\u00e9</b></cache>"}
+        assert client.post("/xml/minify", files=upload).json() == {"pretty": "<cache><b>\u00c3\u00a9</b></cache>"}
+        assert post("/xml/convert", xml).json() == {"cache": {"b": "\u00e9"}}
+        assert client.post("/xml/convert", files=upload).json() == {"cache": {"b": "\u00c3\u00a9"}}